@@ -4,6 +4,9 @@ import sys
 
 class AMR_Alignment:
 
+    # readers create one alignment per aligned token, so avoid a __dict__ per object
+    __slots__ = ('type', 'tokens', 'nodes', 'edges', 'amr')
+
     def __init__(self, type=None, tokens:list=None, nodes:list=None, edges:list=None, amr=None):
         self.type = type if type else 'basic'
         self.tokens = tokens if tokens else []
@@ -51,24 +54,25 @@ def load_from_json(json_file, amrs=None, unanonymize=False):
     with open(json_file, 'r', encoding='utf8') as f:
         alignments = json.load(f)
     for k in alignments:
-        if unanonymize:
-            if unanonymize and not amrs:
+        if unanonymize and alignments[k]:
+            if not amrs:
                 raise Exception('To un-anonymize alignments, the parameter "amrs" is required.')
+            amr = amrs[k]
+            unlabeled_edges = {}
+            for e2 in amr.edges:
+                unlabeled_edges.setdefault((e2[0], e2[2]), e2)
             for a in alignments[k]:
                 if 'nodes' not in a:
                     a['nodes'] = []
                 if 'edges' not in a:
                     a['edges'] = []
-                amr = amrs[k]
                 for i,e in enumerate(a['edges']):
                     s,r,t = e
                     if r is None:
-                        new_e = [e2 for e2 in amr.edges if e2[0]==s and e2[2]==t]
-                        if not new_e:
+                        if (s,t) not in unlabeled_edges:
                             print('Failed to un-anonymize:', amr.id, e, file=sys.stderr)
                         else:
-                            new_e = new_e[0]
-                            a['edges'][i] = [s, new_e[1], t]
+                            a['edges'][i] = [s, unlabeled_edges[(s,t)][1], t]
         alignments[k] = [AMR_Alignment(a['type'], a['tokens'], a['nodes'], [tuple(e) for e in a['edges']]) for a in alignments[k]]
     if amrs:
         for k in alignments:
@@ -79,16 +83,22 @@ def load_from_json(json_file, amrs=None, unanonymize=False):
 
 
 def write_to_json(json_file, alignments, anonymize=False, amrs=None):
+    if anonymize:
+        if not amrs:
+            raise Exception('To anonymize alignments, the parameter "amrs" is required.')
+        amrs = {amr.id:amr for amr in amrs}
     new_alignments = {}
     for k in alignments:
         new_alignments[k] = [a.to_json() for a in alignments[k]]
-        if anonymize:
-            if anonymize and not amrs:
-                raise Exception('To anonymize alignments, the parameter "amrs" is required.')
+        if anonymize and new_alignments[k]:
+            amr = amrs[k]
+            # an edge label can be dropped if no other edge connects the same two nodes
+            unlabeled_edges = {}
+            for e2 in amr.edges:
+                unlabeled_edges[(e2[0], e2[2])] = unlabeled_edges.get((e2[0], e2[2]), 0) + 1
             for a in new_alignments[k]:
-                amr = next(amr_ for amr_ in  amrs if amr_.id==k)
                 for i,e in enumerate(a['edges']):
-                    if len([e2 for e2 in amr.edges if e2[0]==e[0] and e2[2]==e[2]])==1:
+                    if unlabeled_edges.get((e[0], e[2])) == 1:
                         a['edges'][i] = [e[0],None,e[2]]
                 if 'string' in a:
                     del a['string']
@@ -96,7 +106,6 @@ def write_to_json(json_file, alignments, anonymize=False, amrs=None):
                     del a['nodes']
                 if 'edges' in a and not a['edges']:
                     del a['edges']
+    # json.dumps takes the C encoder in one shot; json.dump encodes and writes chunk by chunk in Python
     with open(json_file, 'w+', encoding='utf8') as f:
-        json.dump(new_alignments, f)
-
-
+        f.write(json.dumps(new_alignments))
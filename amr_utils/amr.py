@@ -74,6 +74,17 @@ class AMR:
                 if t==a: t=b
                 self.edges[i] = (s,r,t)
 
+    def _rename_nodes(self, node_map):
+        # rename many nodes in one pass over the edges instead of one pass per node
+        nodes = {node_map.get(n, n): label for n, label in self.nodes.items()}
+        if len(nodes) < len(self.nodes):
+            raise Exception('Rename Nodes: Tried to use existing node name:', node_map)
+        self.nodes.clear()
+        self.nodes.update(nodes)
+        if self.root in node_map:
+            self.root = node_map[self.root]
+        self.edges[:] = [(node_map.get(s, s), r, node_map.get(t, t)) for s, r, t in self.edges]
+
 
 
 def metadata_string(amr):
@@ -1,4 +1,5 @@
 import sys
+from itertools import islice
 
 from amr_readers import AMR_Reader
 from style import HTML_AMR
@@ -6,99 +7,79 @@ from style import HTML_AMR
 
 from amr_utils.graph_utils import get_node_alignment
 
-phase = 1
-
 def style(amr_pairs, other_args, assign_node_color=None, assign_node_desc=None, assign_edge_color=None, assign_edge_desc=None,
           assign_token_color=None, assign_token_desc=None, limit=None):
-    global phase
-    output = '<!DOCTYPE html>\n'
-    output += '<html>\n'
-    output += '<style>\n'
-    output += HTML_AMR.style_sheet()
-    output += '</style>\n\n'
-    output += '<body>\n'
-    i = 0
-    for id in amr_pairs:
-        amr1, amr2 = amr_pairs[id]
-        prec, rec, f1 = other_args[id][-3:]
-        output += f'AMR 1:\n'
-        phase = 1
-        output += HTML_AMR.html(amr1,
-                                assign_node_color, assign_node_desc,
-                                assign_edge_color, assign_edge_desc,
-                                assign_token_color, assign_token_desc,
-                                other_args)
-        output += 'AMR 2:\n'
-        phase = 2
-        output += HTML_AMR.html(amr2,
-                                assign_node_color, assign_node_desc,
-                                assign_edge_color, assign_edge_desc,
-                                assign_token_color, assign_token_desc,
-                                other_args)
-        output += f'SMATCH: precision {100*prec:.1f} recall {100*rec:.1f} f1 {100*f1:.1f}\n'
-        output += '<hr>\n'
-        i+=1
-        if limit and i>limit:
-            break
-    output += '</body>\n'
-    output += '</html>\n'
-    return output
-
-
-def is_correct_node(amr, n, other_args):
-    amr1, amr2, map1, map2 = other_args[amr.id][:4]
-    if phase==1:
-        other_amr = amr2
-        node_map = map1
-    else:
-        other_amr = amr1
-        node_map = map2
+    def pairs():
+        # the limit check used to run after a pair was written, so limit+1 pairs are shown
+        for id, (amr1, amr2) in islice(amr_pairs.items(), limit+1 if limit else None):
+            _, _, map1, map2, prec, rec, f1 = other_args[id]
+            yield ''.join(['AMR 1:\n',
+                           HTML_AMR.html(amr1,
+                                         assign_node_color, assign_node_desc,
+                                         assign_edge_color, assign_edge_desc,
+                                         assign_token_color, assign_token_desc,
+                                         _other_side(amr2, map1)),
+                           'AMR 2:\n',
+                           HTML_AMR.html(amr2,
+                                         assign_node_color, assign_node_desc,
+                                         assign_edge_color, assign_edge_desc,
+                                         assign_token_color, assign_token_desc,
+                                         _other_side(amr1, map2)),
+                           f'SMATCH: precision {100*prec:.1f} recall {100*rec:.1f} f1 {100*f1:.1f}\n'])
+    return HTML_AMR.write_page(pairs())
+
+
+def _other_side(other_amr, node_map):
+    # what the callbacks compare one AMR against: the other AMR, the node map into it,
+    # its edges as a set, edge results already worked out (color and description both ask),
+    # and the first incoming edge of each node of the AMR being styled, filled on first use
+    return other_amr, node_map, frozenset(other_amr.edges), {}, {}
+
+
+def _get_parent_edge(amr, n, other):
+    parent_edges = other[4]
+    if not parent_edges:
+        for s, r, t in amr.edges:
+            parent_edges.setdefault(t, (s, r, t))
+    return parent_edges[n]
+
+
+def _is_matched_edge(e, other):
+    other_amr, node_map, other_edges, edge_matches = other[:4]
+    if e not in edge_matches:
+        s, r, t = e
+        edge_matches[e] = (node_map[s], r, node_map[t]) in other_edges
+    return edge_matches[e]
+
+
+def is_correct_node(amr, n, other):
+    other_amr, node_map = other[:2]
     if amr.nodes[n] == other_amr.nodes[node_map[n]]:
         return ''
     return 'red'
 
 
-def is_correct_edge(amr, e, other_args=None):
-    amr1, amr2, map1, map2 = other_args[amr.id][:4]
-    s,r,t = e
-    if phase == 1:
-        other_amr = amr2
-        node_map = map1
-    else:
-        other_amr = amr1
-        node_map = map2
-    if (node_map[s],r,node_map[t]) in other_amr.edges:
+def is_correct_edge(amr, e, other):
+    if _is_matched_edge(e, other):
         return ''
     return 'red'
 
 
-def is_correct_node_desc(amr, n, other_args=None):
-    amr1, amr2, map1, map2 = other_args[amr.id][:4]
-    if phase == 1:
-        other_amr = amr2
-        node_map = map1
-    else:
-        other_amr = amr1
-        node_map = map2
+def is_correct_node_desc(amr, n, other):
+    other_amr, node_map = other[:2]
     if amr.nodes[n] == other_amr.nodes[node_map[n]]:
         return ''
     if not amr.nodes[n][0].isalpha() or amr.nodes[n] in ['imperative', 'expressive', 'interrogative']:
-        s,r,t = [(s,r,t) for s,r,t in amr.edges if t==n][0]
+        s,r,t = _get_parent_edge(amr, n, other)
         return f'No corresponding attribute {other_amr.nodes[node_map[s]]} {r} {amr.nodes[t]}'
     return f'{amr.nodes[n]} != {other_amr.nodes[node_map[n]]}'
 
 
-def is_correct_edge_desc(amr, e, other_args=None):
-    amr1, amr2, map1, map2 = other_args[amr.id][:4]
-    s, r, t = e
-    if phase == 1:
-        other_amr = amr2
-        node_map = map1
-    else:
-        other_amr = amr1
-        node_map = map2
-    if (node_map[s], r, node_map[t]) in other_amr.edges:
+def is_correct_edge_desc(amr, e, other):
+    if _is_matched_edge(e, other):
         return ''
+    other_amr, node_map = other[:2]
+    s, r, t = e
     # attribute
     if not amr.nodes[t][0].isalpha() or amr.nodes[t] in ['imperative', 'expressive', 'interrogative']:
         return f'No corresponding attribute {other_amr.nodes[node_map[s]]} {r} {amr.nodes[t]}'
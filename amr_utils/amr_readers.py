@@ -1,9 +1,15 @@
+import hashlib
+import multiprocessing
 import os
+import pickle
 import re
 import sys
-import csv
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 
 import penman
+from penman.surface import Alignment, RoleAlignment
 
 from amr_utils.alignments import AMR_Alignment, write_to_json, load_from_json
 from amr_utils.amr import AMR
@@ -11,68 +17,64 @@ from amr_utils.amr import AMR
 
 class Matedata_Parser:
 
-    token_range_re = re.compile('^(\d-\d|\d(,\d)+)$')
+    token_range_re = re.compile(r'\d+(-\d+|(,\d+)+)')
     metadata_re = re.compile('(?<=[^#]) ::')
 
     def __init__(self):
-        pass
+        # how to read the value of each '# ::label' line; other labels are kept as raw strings
+        self.line_parsers = {
+            'id': str.strip,
+            'snt': str.strip,
+            'alignments': str.strip,
+            'tok': str.split,
+            'node': self.read_graph_metadata_,
+            'root': self.read_graph_metadata_,
+            'edge': self.read_graph_metadata_,
+        }
 
     def get_token_range(self, string):
         if '-' in string:
-            start = int(string.split('-')[0])
-            end = int(string.split('-')[-1])
-            return [i for i in range(start, end)]
+            start, _, end = string.partition('-')
+            return list(range(int(start), int(end)))
         else:
             return [int(i) for i in string.split(',')]
 
     def readlines(self, lines):
-        lines = self.metadata_re.sub('\n# ::', lines)
+        # every ' ::' belongs to a '# ::' unless several fields share a line
+        if lines.count(' ::') > lines.count('# ::'):
+            lines = self.metadata_re.sub('\n# ::', lines)
         metadata = {}
         graph_metadata = {}
-        rows = [self.readline_(line) for line in lines.split('\n')]
-        labels = {label for label,_ in rows}
-        for label in labels:
-            if label in ['root','node','edge']:
-                graph_metadata[label] = [val for l,val in rows if label==l]
-            else:
-                metadata[label] = [val for l,val in rows if label==l][0]
+        for line in lines.split('\n'):
+            label, val = self.readline_(line)
+            if label in ('root', 'node', 'edge'):
+                graph_metadata.setdefault(label, []).append(val)
+            elif label not in metadata:
+                # a repeated label keeps its first value
+                metadata[label] = val
         if 'snt' not in metadata and 'tok' not in metadata:
             metadata['snt'] = ['']
         return metadata, graph_metadata
 
     def readline_(self, line):
         if not line.startswith('#'):
-            label = 'snt'
-            metadata = line.strip()
-        elif line.startswith('# ::id'):
-            label = 'id'
-            metadata = line[len('# ::id '):].strip()
-        elif line.startswith("# ::tok"):
-            label = 'tok'
-            metadata = line[len('# ::tok '):].strip().split()
-        elif line.startswith('# ::snt '):
-            label = 'snt'
-            metadata = line[len('# ::snt '):].strip()
-        elif line.startswith('# ::alignments'):
-            label = 'alignments'
-            metadata = line[len('# ::alignments '):].strip()
-        elif line.startswith('# ::node') or line.startswith('# ::root') or line.startswith('# ::edge'):
-            label = line[len('# ::'):].split()[0]
-            line = line[len(f'# ::{label} '):]
-            rows = [row for row in csv.reader([line], delimiter='\t', quotechar='|')]
-            metadata = rows[0]
-            for i, s in enumerate(metadata):
-                if self.token_range_re.match(s):
-                    metadata[i] = self.get_token_range(s)
-        elif line.startswith('# ::'):
-            label = line[len('# ::'):].split()[0]
-            line = line[len(f'# ::{label} '):]
-            metadata = line
-        else:
-            label = 'snt'
-            metadata = line[len('# '):].strip()
+            return 'snt', line.strip()
+        if not line.startswith('# ::'):
+            return 'snt', line[len('# '):].strip()
+        # only the first word is the label; splitting the whole line would also split every token of '# ::tok'
+        label = line[len('# ::'):].split(maxsplit=1)[0]
+        metadata = line[len(f'# ::{label} '):]
+        if label in self.line_parsers:
+            metadata = self.line_parsers[label](metadata)
         return label, metadata
 
+    def read_graph_metadata_(self, line):
+        metadata = line.split('\t')
+        for i, s in enumerate(metadata):
+            if s[:1].isdigit() and self.token_range_re.fullmatch(s):
+                metadata[i] = self.get_token_range(s)
+        return metadata
+
 
 from penman.model import Model
 
@@ -87,13 +89,21 @@ class TreePenmanModel(Model):
 
 class PENMAN_Wrapper:
 
+    # the model holds no per-graph state, so one instance is shared by every decode
+    tree_model = TreePenmanModel()
+    # penman < 1.0 has a Graph.triples() method, newer versions set a triples list on each graph
+    triples_is_method = callable(getattr(penman.Graph, 'triples', None))
+
     def __init__(self, style='isi'):
         self.style = style
 
     def parse_amr(self, tokens, amr_string):
+        g = penman.decode(amr_string, model=self.tree_model)
+        return self.parse_graph(tokens, g)
+
+    def parse_graph(self, tokens, g):
         amr = AMR(tokens=tokens)
-        g = penman.decode(amr_string, model=TreePenmanModel())
-        triples = g.triples() if callable(g.triples) else g.triples
+        triples = g.triples() if self.triples_is_method else g.triples
 
         letter_labels = {}
         isi_labels = {g.top: '1'}
@@ -109,6 +119,9 @@ class PENMAN_Wrapper:
         attributes = []
         edges = []
         reentrancies = []
+        epidata = dict(g.epidata)
+        aligned_triples = []
+        num_triples = len(triples)
 
         for i,tr in enumerate(triples):
             s, r, t = tr
@@ -116,20 +129,22 @@ class PENMAN_Wrapper:
             if r == ':instance':
                 if reentrancies and edges[-1]==reentrancies[-1]:
                     s2,r2,t2 = edges[-1]
-                    jamr_labels[t2] = jamr_labels[s2] + '.' + str(jamr_edge_idx[s2])
-                    isi_labels[t2] = isi_labels[s2] + '.' + str(isi_edge_idx[s2])
+                    jamr_labels[t2] = f'{jamr_labels[s2]}.{jamr_edge_idx[s2]}'
+                    isi_labels[t2] = f'{isi_labels[s2]}.{isi_edge_idx[s2]}'
                 new_s = s
                 while new_s in letter_labels:
                     new_idx += 1
                     new_s = f'x{new_idx}'
                 letter_labels[s] = new_s
                 nodes.append(tr)
+                kind = 'node'
             # an amr edge
             elif t not in letter_labels:
                 if len(t) > 5 or not t[0].isalpha():
+                    isi_label = f'{isi_labels[s]}.{isi_edge_idx[s]}'
                     if tr in letter_labels:
-                        isi_labels['ignore'] = isi_labels[s] + '.' + str(isi_edge_idx[s])
-                        isi_edge_labels['ignore'] = isi_labels[s] + '.' + str(isi_edge_idx[s])+'.r'
+                        isi_labels['ignore'] = isi_label
+                        isi_edge_labels['ignore'] = isi_label + '.r'
                         isi_edge_idx[s] += 1
                         jamr_edge_idx[s] += 1
                         continue
@@ -139,29 +154,36 @@ class PENMAN_Wrapper:
                         new_idx += 1
                         new_s = f'x{new_idx}'
                     letter_labels[tr] = new_s
-                    jamr_labels[tr] = jamr_labels[s] + '.' + str(jamr_edge_idx[s])
-                    isi_labels[tr] = isi_labels[s] + '.' + str(isi_edge_idx[s])
-                    isi_edge_labels[tr] = isi_labels[s] + '.' + str(isi_edge_idx[s])+'.r'
+                    jamr_labels[tr] = f'{jamr_labels[s]}.{jamr_edge_idx[s]}'
+                    isi_labels[tr] = isi_label
+                    isi_edge_labels[tr] = isi_label + '.r'
                     isi_edge_idx[s] += 1
                     jamr_edge_idx[s] += 1
                     attributes.append(tr)
+                    kind = 'attribute'
                 else:
                     # edge
                     jamr_edge_idx[t] = 0
                     isi_edge_idx[t] = 1
-                    jamr_labels[t] = jamr_labels[s] + '.' + str(jamr_edge_idx[s])
-                    if i+1<len(triples) and triples[i+1][1]==':instance':
+                    jamr_labels[t] = f'{jamr_labels[s]}.{jamr_edge_idx[s]}'
+                    if i+1<num_triples and triples[i+1][1]==':instance':
                         jamr_edge_idx[s] += 1
-                    isi_labels[t] = isi_labels[s] + '.' + str(isi_edge_idx[s])
-                    isi_edge_labels[tr] = isi_labels[s] + '.' + str(isi_edge_idx[s])+'.r'
+                    isi_label = f'{isi_labels[s]}.{isi_edge_idx[s]}'
+                    isi_labels[t] = isi_label
+                    isi_edge_labels[tr] = isi_label + '.r'
                     isi_edge_idx[s] += 1
                     edges.append(tr)
+                    kind = 'edge'
             else:
                 # reentrancy
-                isi_edge_labels[tr] = isi_labels[s] + '.' + str(isi_edge_idx[s]) + '.r'
+                isi_edge_labels[tr] = f'{isi_labels[s]}.{isi_edge_idx[s]}.r'
                 isi_edge_idx[s] += 1
                 edges.append(tr)
                 reentrancies.append(tr)
+                kind = 'edge'
+            # alignments are resolved once node labels are final
+            if tr in epidata:
+                aligned_triples.append((kind, tr, epidata.pop(tr)))
 
         default_labels = letter_labels
         if self.style=='isi':
@@ -170,6 +192,7 @@ class PENMAN_Wrapper:
             default_labels = jamr_labels
 
         amr.root = default_labels[g.top]
+        # roles come from a small vocabulary, so every edge can share one string per role
         edge_map = {}
         for tr in nodes:
             s,r,t = tr
@@ -177,27 +200,31 @@ class PENMAN_Wrapper:
         for tr in attributes:
             s,r,t = tr
             if not r.startswith(':'): r = ':' + r
+            r = sys.intern(r)
             amr.nodes[default_labels[tr]] = t
-            amr.edges.append((default_labels[s], r, default_labels[tr]))
-            edge_map[tr] = (default_labels[s], r, default_labels[tr])
+            edge = edge_map[tr] = (default_labels[s], r, default_labels[tr])
+            amr.edges.append(edge)
         for tr in edges:
             s, r, t = tr
             if not r.startswith(':'): r = ':' + r
-            amr.edges.append((default_labels[s], r, default_labels[t]))
-            edge_map[tr] = (default_labels[s], r, default_labels[t])
+            r = sys.intern(r)
+            edge = edge_map[tr] = (default_labels[s], r, default_labels[t])
+            amr.edges.append(edge)
 
         aligns = []
-        for tr, epidata in g.epidata.items():
-            for align in epidata:
-                if 'Alignment' in type(align).__name__:
-                    indices = align.indices
-                    s,r,t = tr
-                    if tr[1] == ':instance':
-                        align = AMR_Alignment(type='isi', tokens=list(indices), nodes=[default_labels[s]])
-                    elif len(t) > 5 or not t[0].isalpha():
-                        align = AMR_Alignment(type='isi', tokens=list(indices), nodes=[default_labels[tr]])
+        for kind, tr, data in aligned_triples:
+            if kind == 'node':
+                label = default_labels[tr[0]]
+            elif kind == 'attribute':
+                label = default_labels[tr]
+            else:
+                label = edge_map[tr]
+            for align in data:
+                if isinstance(align, (Alignment, RoleAlignment)):
+                    if kind == 'edge':
+                        align = AMR_Alignment(type='isi', tokens=list(align.indices), edges=[label])
                     else:
-                        align = AMR_Alignment(type='isi', tokens=list(indices), edges=[edge_map[tr]])
+                        align = AMR_Alignment(type='isi', tokens=list(align.indices), nodes=[label])
                     aligns.append(align)
 
         letter_labels = {v: default_labels[k] for k,v in letter_labels.items()}
@@ -210,120 +237,185 @@ class PENMAN_Wrapper:
 
 class AMR_Reader:
 
+    spaces_re = re.compile(' +')
+
+    CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'amr_utils')
+
     def __init__(self, style='isi'):
         self.style=style
 
-    def load(self, amr_file_name, remove_wiki=False, output_alignments=False):
+    def load(self, amr_file_name, remove_wiki=False, output_alignments=False, cache=False, num_workers=1):
         print('[amr]', 'Loading AMRs from file:', amr_file_name)
+        cache_file = None
+        if cache:
+            cache_file = self._cache_file(amr_file_name, remove_wiki, output_alignments)
+            if os.path.isfile(cache_file):
+                try:
+                    with open(cache_file, 'rb') as f:
+                        return pickle.load(f)
+                except (pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+                    # unreadable or truncated cache file, parse again
+                    pass
         amrs = []
         alignments = {}
-        penman_wrapper = PENMAN_Wrapper(style=self.style)
-        metadata_parser = Matedata_Parser()
-
-        with open(amr_file_name, 'r', encoding='utf8') as f:
-            sents = f.read().replace('\r', '').split('\n\n')
-            amr_idx = 0
-            no_tokens = False
-            if all(sent.strip().startswith('(') for sent in sents):
-                no_tokens = True
-
-            for sent in sents:
-                prefix_lines = [line for i,line in enumerate(sent.split('\n')) if line.strip().startswith('#') or (i==0 and not no_tokens)]
-                prefix = '\n'.join(prefix_lines)
-                amr_string_lines = [line for i, line in enumerate(sent.split('\n'))
-                                    if not line.strip().startswith('#') and (i>0 or no_tokens)]
-                amr_string = ''.join(amr_string_lines).strip()
-                amr_string = re.sub(' +', ' ', amr_string)
-                if not amr_string: continue
-                if not amr_string.startswith('(') or not amr_string.endswith(')'):
-                    raise Exception('Could not parse AMR from: ', amr_string)
-                metadata, graph_metadata = metadata_parser.readlines(prefix)
-                tokens = metadata['tok'] if 'tok' in metadata else metadata['snt'].split()
-                tokens = self._clean_tokens(tokens)
-                if graph_metadata:
-                    amr, aligns = self._parse_amr_from_metadata(tokens, graph_metadata)
-                    amr.id = metadata['id']
-                    if output_alignments:
-                        alignments[amr.id] = aligns
-                else:
-                    amr, other_stuff = penman_wrapper.parse_amr(tokens, amr_string)
-                    if 'id' in metadata:
-                        amr.id = metadata['id']
-                    else:
-                        amr.id = str(amr_idx)
-                    if output_alignments:
-                        alignments[amr.id] = []
-                        if 'alignments' in metadata:
-                            aligns = metadata['alignments'].split()
-                            if any('|' in a for a in aligns):
-                                jamr_labels = other_stuff[1]
-                                alignments[amr.id] = self._parse_jamr_alignments(amr, amr_file_name, aligns, jamr_labels, metadata_parser)
-                            else:
-                                isi_labels, isi_edge_labels = other_stuff[2:4]
-                                alignments[amr.id] = self._parse_isi_alignments(amr, amr_file_name, aligns, isi_labels, isi_edge_labels)
-                        else:
-                            aligns = other_stuff[4]
-                            alignments[amr.id] = aligns
-                amr.metadata = {k:v for k,v in metadata.items() if k not in ['tok','id']}
+        if num_workers is None:
+            num_workers = max(os.cpu_count() - 1, 1)
+
+        with open(amr_file_name, 'r', encoding='utf8', buffering=1 << 20) as f:
+            blocks = self._iterate_blocks(f)
+            args = (repeat(amr_file_name), repeat(output_alignments))
+            if num_workers > 1:
+                # each worker builds its own penman wrapper and metadata parser once
+                with ProcessPoolExecutor(num_workers, initializer=_init_parsers, initargs=(self.style,)) as executor:
+                    parsed = list(executor.map(_parse_block, repeat(self), blocks, *args, chunksize=64))
+            else:
+                penman_wrapper = PENMAN_Wrapper(style=self.style)
+                metadata_parser = Matedata_Parser()
+                parsed = map(self._parse_block, blocks, *args, repeat(penman_wrapper), repeat(metadata_parser))
+            for amr, aligns in parsed:
+                if amr is None:
+                    continue
+                if amr.id is None:
+                    amr.id = str(len(amrs))
+                if output_alignments:
+                    alignments[amr.id] = aligns
                 amrs.append(amr)
-                amr_idx += 1
         if remove_wiki:
             for amr in amrs:
-                wiki_nodes = []
-                wiki_edges = []
-                for s, r, t in amr.edges.copy():
-                    if r == ':wiki':
-                        amr.edges.remove((s, r, t))
-                        del amr.nodes[t]
-                        wiki_nodes.append(t)
-                        wiki_edges.append((s,r,t))
-                if alignments and amr.id in alignments:
+                wiki_edges = {e for e in amr.edges if e[1] == ':wiki'}
+                if not wiki_edges:
+                    continue
+                wiki_nodes = {t for s, r, t in wiki_edges}
+                amr.edges = [e for e in amr.edges if e[1] != ':wiki']
+                for n in wiki_nodes:
+                    amr.nodes.pop(n, None)
+                if amr.id in alignments:
                     for align in alignments[amr.id]:
-                        for n in wiki_nodes:
-                            if n in align.nodes:
-                                align.nodes.remove(n)
-                        for e in wiki_edges:
-                            if e in align.edges:
-                                align.edges.remove(e)
-        if output_alignments:
-            return amrs, alignments
-        return amrs
+                        align.nodes = [n for n in align.nodes if n not in wiki_nodes]
+                        align.edges = [e for e in align.edges if e not in wiki_edges]
+        output = (amrs, alignments) if output_alignments else amrs
+        if cache_file:
+            self._save_cache(cache_file, output)
+        return output
+
+    def _parse_block(self, lines, amr_file_name, output_alignments, penman_wrapper, metadata_parser):
+        # returns (None, None) for blocks without an AMR; amr.id is None if the block has no '# ::id'
+        # an untagged first line is the sentence, unless the block starts with the graph
+        no_tokens = lines[0].lstrip().startswith('(')
+        prefix_lines = [] if no_tokens else [lines[0]]
+        amr_string_lines = [lines[0]] if no_tokens else []
+        for line in lines[1:]:
+            if line.lstrip().startswith('#'):
+                prefix_lines.append(line)
+            else:
+                amr_string_lines.append(line)
+        prefix = '\n'.join(prefix_lines)
+        amr_string = ''.join(amr_string_lines).strip()
+        if '  ' in amr_string:
+            amr_string = self.spaces_re.sub(' ', amr_string)
+        if not amr_string:
+            return None, None
+        if not amr_string.startswith('(') or not amr_string.endswith(')'):
+            raise Exception('Could not parse AMR from: ', amr_string)
+        metadata, graph_metadata = metadata_parser.readlines(prefix)
+        tokens = metadata['tok'] if 'tok' in metadata else metadata['snt'].split()
+        tokens = self._clean_tokens(tokens)
+        aligns = None
+        if graph_metadata:
+            amr, aligns = self._parse_amr_from_metadata(tokens, graph_metadata)
+            amr.id = metadata['id']
+        else:
+            amr, other_stuff = penman_wrapper.parse_amr(tokens, amr_string)
+            amr.id = metadata.get('id')
+            if output_alignments:
+                if 'alignments' in metadata:
+                    aligns = metadata['alignments'].split()
+                    if any('|' in a for a in aligns):
+                        jamr_labels = other_stuff[1]
+                        aligns = self._parse_jamr_alignments(amr, amr_file_name, aligns, jamr_labels, metadata_parser)
+                    else:
+                        isi_labels, isi_edge_labels = other_stuff[2:4]
+                        aligns = self._parse_isi_alignments(amr, amr_file_name, aligns, isi_labels, isi_edge_labels)
+                else:
+                    aligns = other_stuff[4]
+        amr.metadata = {k:v for k,v in metadata.items() if k not in ['tok','id']}
+        return amr, aligns
+
+    @staticmethod
+    def _iterate_blocks(f):
+        # text mode already translates '\r\n' and '\r' to '\n'
+        lines = []
+        for line in f:
+            line = line.rstrip('\n')
+            if line.strip():
+                lines.append(line)
+            elif lines:
+                yield lines
+                lines = []
+        if lines:
+            yield lines
+
+    def _cache_file(self, amr_file_name, remove_wiki, output_alignments):
+        stat = os.stat(amr_file_name)
+        key = (_source_hash(), self.style, os.path.abspath(amr_file_name), stat.st_mtime, stat.st_size,
+               remove_wiki, output_alignments)
+        key = hashlib.md5(repr(key).encode('utf8')).hexdigest()
+        return os.path.join(self.CACHE_DIR, key + '.pkl')
 
-    def load_from_dir(self, dir, remove_wiki=False, output_alignments=False):
+    @staticmethod
+    def _save_cache(cache_file, output):
+        # write to a temp file first so a concurrent reader never sees a partial pickle
+        try:
+            os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+            with tempfile.NamedTemporaryFile('wb', dir=os.path.dirname(cache_file), delete=False) as f:
+                pickle.dump(output, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(f.name, cache_file)
+        except OSError as e:
+            print('[amr]', 'Failed to cache AMRs:', cache_file, e, file=sys.stderr)
+
+    def load_from_dir(self, dir, remove_wiki=False, output_alignments=False, cache=False, num_workers=1):
         all_amrs = []
         all_alignments = {}
 
+        with os.scandir(dir) as it:
+            entries = [entry for entry in it if entry.name.endswith('.txt')]
+        filenames = [entry.name for entry in entries]
+        args = [(self, entry.path, remove_wiki, cache) for entry in entries]
+        if num_workers is None:
+            num_workers = max(os.cpu_count() - 1, 1)
+        if num_workers > 1:
+            with multiprocessing.Pool(num_workers) as pool:
+                results = pool.starmap(_load_file, args)
+        else:
+            results = (_load_file(*a) for a in args)
+
         taken_ids = set()
-        for filename in os.listdir(dir):
-            if filename.endswith('.txt'):
-                print(filename)
-                file = os.path.join(dir, filename)
-                amrs, aligns = self.load(file, output_alignments=True, remove_wiki=remove_wiki)
-                for amr in amrs:
-                    if amr.id.isdigit():
-                        old_id = amr.id
-                        amr.id = filename+':'+old_id
+        for filename, (amrs, aligns) in zip(filenames, results):
+            print(filename)
+            for amr in amrs:
+                if amr.id.isdigit():
+                    old_id = amr.id
+                    amr.id = filename+':'+old_id
+                    aligns[amr.id] = aligns[old_id]
+                    del aligns[old_id]
+            for amr in amrs:
+                if amr.id in taken_ids:
+                    old_id = amr.id
+                    amr.id += '#2'
+                    if old_id in aligns:
                         aligns[amr.id] = aligns[old_id]
                         del aligns[old_id]
-                for amr in amrs:
-                    if amr.id in taken_ids:
-                        old_id = amr.id
-                        amr.id += '#2'
-                        if old_id in aligns:
-                            aligns[amr.id] = aligns[old_id]
-                            del aligns[old_id]
-                    taken_ids.add(amr.id)
-                all_amrs.extend(amrs)
-                all_alignments.update(aligns)
+                taken_ids.add(amr.id)
+            all_amrs.extend(amrs)
+            all_alignments.update(aligns)
         if output_alignments:
             return all_amrs, all_alignments
         return all_amrs
 
     @staticmethod
     def write_to_file(output_file, amrs):
-        with open(output_file, 'w+', encoding='utf8') as f:
-            for amr in amrs:
-                f.write(amr.amr_string())
+        with open(output_file, 'w+', encoding='utf8', buffering=1 << 20) as f:
+            f.writelines(amr.amr_string() for amr in amrs)
 
     @staticmethod
     def load_alignments_from_json(json_file, amrs=None):
@@ -335,11 +427,13 @@ class AMR_Reader:
 
     @staticmethod
     def _parse_jamr_alignments(amr, amr_file, aligns, jamr_labels, metadata_parser):
-        aligns = [(metadata_parser.get_token_range(a.split('|')[0]), a.split('|')[-1].split('+')) for a in aligns if '|' in a]
+        aligns = [a.partition('|') for a in aligns if '|' in a]
+        aligns = [(metadata_parser.get_token_range(toks), components.split('+')) for toks, _, components in aligns]
 
         alignments = []
+        num_tokens = len(amr.tokens)
         for toks, components in aligns:
-            if not all(n in jamr_labels for n in components) or any(t>=len(amr.tokens) for t in toks):
+            if not all(n in jamr_labels for n in components) or any(t>=num_tokens for t in toks):
                 raise Exception('Could not parse alignment:', amr_file, amr.id, toks, components)
             nodes = [jamr_labels[n] for n in components]
             new_align = AMR_Alignment(type='jamr', tokens=toks, nodes=nodes)
@@ -348,21 +442,25 @@ class AMR_Reader:
 
     @staticmethod
     def _parse_isi_alignments(amr, amr_file, aligns, isi_labels, isi_edge_labels):
-        aligns = [(int(a.split('-')[0]), a.split('-')[-1]) for a in aligns if '-' in a]
+        aligns = [a.partition('-') for a in aligns if '-' in a]
+        aligns = [(int(tok), component) for tok, _, component in aligns]
 
         alignments = []
+        edges_set = set(amr.edges)
+        num_tokens = len(amr.tokens)
         xml_offset = 1 if amr.tokens[0].startswith('<') and amr.tokens[0].endswith('>') else 0
-        if any(t + xml_offset >= len(amr.tokens) for t, n in aligns):
+        if xml_offset and any(t + 1 >= num_tokens for t, n in aligns):
             xml_offset = 0
 
         for tok, component in aligns:
             tok += xml_offset
             nodes = []
             edges = []
-            if component.replace('.r', '') in isi_labels:
+            n = isi_labels.get(component.replace('.r', ''))
+            if n == 'ignore':
+                continue
+            if n is not None:
                 # node or attribute
-                n = isi_labels[component.replace('.r', '')]
-                if n=='ignore': continue
                 nodes.append(n)
                 if n not in amr.nodes:
                     raise Exception('Could not parse alignment:', amr_file, amr.id, tok, component)
@@ -370,20 +468,20 @@ class AMR_Reader:
                 # reentrancy
                 e = isi_edge_labels[component + '.r']
                 edges.append(e)
-                if e not in amr.edges:
+                if e not in edges_set:
                     raise Exception('Could not parse alignment:', amr_file, amr.id, tok, component)
             elif component.endswith('.r'):
                 # edge
                 e = isi_edge_labels[component]
                 if e == 'ignore': continue
                 edges.append(e)
-                if e not in amr.edges:
+                if e not in edges_set:
                     raise Exception('Could not parse alignment:', amr_file, amr.id, tok, component)
             elif component == '0.r':
                 nodes.append(amr.root)
             else:
                 raise Exception('Could not parse alignment:', amr_file, amr.id, tok, component)
-            if tok >= len(amr.tokens):
+            if tok >= num_tokens:
                 raise Exception('Could not parse alignment:', amr_file, amr.id, tok, component)
             new_align = AMR_Alignment(type='isi', tokens=[tok], nodes=nodes, edges=edges)
             alignments.append(new_align)
@@ -419,7 +517,7 @@ class AMR_Reader:
                 toks = data[5]
                 alignments.append(AMR_Alignment(type='jamr', edges=[(s,r,t)], tokens=toks))
             if not r.startswith(':'): r = ':'+r
-            amr.edges.append((s,r,t))
+            amr.edges.append((s,sys.intern(r),t))
         return amr, alignments
 
     @staticmethod
@@ -444,6 +542,37 @@ class AMR_Reader:
 
 
 
+worker_parsers = None
+
+def _init_parsers(style):
+    global worker_parsers
+    worker_parsers = (PENMAN_Wrapper(style=style), Matedata_Parser())
+
+
+def _parse_block(reader, lines, amr_file_name, output_alignments):
+    # module level so it can run in worker processes with that worker's parsers
+    return reader._parse_block(lines, amr_file_name, output_alignments, *worker_parsers)
+
+
+def _load_file(reader, file, remove_wiki, cache):
+    # module level so it can be sent to worker processes
+    return reader.load(file, output_alignments=True, remove_wiki=remove_wiki, cache=cache)
+
+
+_source_digest = None
+
+def _source_hash():
+    # cached AMRs are only valid for the code that parsed and pickled them
+    global _source_digest
+    if _source_digest is None:
+        digest = hashlib.md5()
+        for module in [__name__, 'amr_utils.amr', 'amr_utils.alignments']:
+            with open(sys.modules[module].__file__, 'rb') as f:
+                digest.update(f.read())
+        _source_digest = digest.hexdigest()
+    return _source_digest
+
+
 def main():
     dir = sys.argv[1]
     output_file = sys.argv[2]
@@ -1,3 +1,5 @@
+import multiprocessing
+import os
 import sys
 
 from amr_utils.amr_readers import AMR_Reader
@@ -42,7 +44,9 @@ def get_token_aligned_subgraph(amr, tok, alignments):
         elems = [amr.nodes[n] for n in align.nodes]
         elems += [r for s,r,t in align.edges]
         # return ' '.join(elems)
-        edges = [(s,r,t) for s,r,t in amr.edges if ((s,r,t) in align.edges or (s in align.nodes and t in align.nodes))]
+        align_nodes = set(align.nodes)
+        align_edges = set(align.edges)
+        edges = [(s,r,t) for s,r,t in amr.edges if ((s,r,t) in align_edges or (s in align_nodes and t in align_nodes))]
         sg = get_subgraph(amr, align.nodes, edges)
         if is_rooted_dag(amr, align.nodes):
             out = sg.graph_string()
@@ -52,18 +56,36 @@ def get_token_aligned_subgraph(amr, tok, alignments):
     return ''
 
 
-def style(amrs, alignments, outfile):
-    output = HTML_AMR.style(amrs[:5000],
-                            assign_node_color=is_aligned_node,
-                            assign_edge_color=is_aligned_edge,
-                            assign_token_color=is_aligned_token,
-                            assign_node_desc=get_node_aligned_tokens,
-                            assign_edge_desc=get_edge_aligned_tokens,
-                            assign_token_desc=get_token_aligned_subgraph,
-                            other_args=alignments)
+_callbacks = dict(assign_node_color=is_aligned_node,
+                  assign_edge_color=is_aligned_edge,
+                  assign_token_color=is_aligned_token,
+                  assign_node_desc=get_node_aligned_tokens,
+                  assign_edge_desc=get_edge_aligned_tokens,
+                  assign_token_desc=get_token_aligned_subgraph)
 
+
+def _html(amr, alignments):
+    # module level so it can be sent to worker processes
+    return HTML_AMR.html(amr, other_args=alignments, **_callbacks)
+
+
+def _html_args(args):
+    return _html(*args)
+
+
+def style(amrs, alignments, outfile, num_workers=1):
+    amrs = amrs[:5000]
+    if num_workers is None:
+        num_workers = max(os.cpu_count() - 1, 1)
+    # write each AMR as soon as it is rendered rather than holding the whole page in memory
     with open(outfile, 'w+', encoding='utf8') as f:
-        f.write(output)
+        if num_workers > 1:
+            # each AMR only needs its own alignments, so don't send the whole dict with every AMR
+            args = ((amr, {amr.id: alignments[amr.id]} if amr.id in alignments else {}) for amr in amrs)
+            with multiprocessing.Pool(num_workers) as pool:
+                HTML_AMR.write_page(pool.imap(_html_args, args, chunksize=32), f)
+        else:
+            HTML_AMR.style(amrs, other_args=alignments, out=f, **_callbacks)
 
 
 def main():
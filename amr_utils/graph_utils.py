@@ -1,4 +1,5 @@
 
+from amr_utils.alignments import AMR_Alignment
 from amr_utils.amr import AMR
 from amr_utils.smatch import get_best_match
 
@@ -6,12 +7,9 @@ from amr_utils.smatch import get_best_match
 def get_subgraph(amr, nodes: list, edges: list):
     if not nodes:
         return AMR()
-    potential_root = nodes.copy()
-    for x, r, y in amr.edges:
-        if x in nodes and y in nodes:
-            if y in potential_root:
-                potential_root.remove(y)
-    root = potential_root[0] if len(potential_root) > 0 else nodes[0]
+    node_set = set(nodes)
+    targets = {y for x, r, y in amr.edges if x in node_set and y in node_set}
+    root = next((n for n in nodes if n not in targets), nodes[0])
     sub = AMR(root=root,
                edges=edges,
                nodes={n: amr.nodes[n] for n in nodes})
@@ -26,11 +24,14 @@ def get_subgraph(amr, nodes: list, edges: list):
 def is_rooted_dag(amr, nodes):
     if not nodes:
         return False
-    roots = nodes.copy()
-    edges = [(s,r,t) for s,r,t in amr.edges if s in nodes and t in nodes]
-    for s,r,t in edges:
-        if t in roots:
-            roots.remove(t)
+    node_set = set(nodes)
+    roots = set(nodes)
+    for s,r,t in amr.edges:
+        if s in node_set and t in node_set:
+            roots.discard(t)
+            # roots only shrink, so once none are left there is no root to find
+            if not roots:
+                return False
     if len(roots)==1:
         return True
     return False
@@ -41,70 +42,73 @@ def get_connected_components(amr, nodes):
     if not nodes:
         return []
     descendants = {n:{n} for n in nodes}
-    roots = [n for n in nodes]
-    taken = set()
-    edges = [(s, r, t) for s, r, t in breadth_first_edges(amr, ignore_reentrancies=True) if s in nodes and t in nodes]
-    for s, r, t in edges:
-        if t in taken: continue
-        taken.add(t)
-        if t in roots:
-            roots.remove(t)
-        for d in descendants:
-            if s in descendants[d]:
-                descendants[d].update(descendants[t])
+    node_set = set(nodes)
+    edges = [(s, r, t) for s, r, t in breadth_first_edges(amr, ignore_reentrancies=True) if s in node_set and t in node_set]
+    taken = {t for s, r, t in edges}
+    roots = [n for n in nodes if n not in taken]
+    # the edges form a forest in breadth first order, so walking them backwards
+    # finishes each subtree before it is added to its parent
+    for s, r, t in reversed(edges):
+        descendants[s].update(descendants[t])
     components = []
     for root in roots:
-        edges = []
-        for s,r,t in breadth_first_edges(amr, ignore_reentrancies=True):
-            if s in descendants[root] and t in descendants[root]:
-                edges.append((s,r,t))
-        sub = AMR(nodes={n:amr.nodes[n] for n in descendants[root]}, root=root, edges=edges)
+        component_edges = [(s,r,t) for s,r,t in edges if s in descendants[root] and t in descendants[root]]
+        sub = AMR(nodes={n:amr.nodes[n] for n in descendants[root]}, root=root, edges=component_edges)
         components.append(sub)
     components = sorted(components, key=lambda x:len(x.nodes), reverse=True)
     return list(components)
 
 
-def is_projective_node_(amr, n, descendants, positions, ignore=None):
-    span = {positions[m] for m in descendants if m in positions}
-    if not span:
+def is_projective_node_(amr, n, descendants, positions, token_alignments, ignore=None):
+    desc_positions = [positions[m] for m in descendants if m in positions]
+    if not desc_positions:
         return True, []
-    max_token = max(span)
-    min_token = min(span)
+    max_token = max(desc_positions)
+    min_token = min(desc_positions)
     if max_token - min_token <= 1:
-        return True, [i for i in range(min_token,max_token+1)]
+        return True, list(range(min_token,max_token+1))
+    # only spans with a gap need membership tests
+    span = set(desc_positions)
     for tok in range(min_token + 1, max_token):
         if ignore and tok in ignore:
             continue
         if tok in span:
             continue
-        align = amr.get_alignment(token_id=tok)
+        align = token_alignments.get(tok)
         if align and align.tokens[0] not in span:
-            return False, [i for i in range(min_token,max_token+1)]
-    return True, [i for i in range(min_token,max_token+1)]
+            return False, list(range(min_token,max_token+1))
+    return True, list(range(min_token,max_token+1))
 
 
-def is_projective(amr):
+def is_projective(amr, alignments):
 
     descendants = {n: {n} for n in amr.nodes.keys()}
-    for s, r, t in breadth_first_edges(amr, ignore_reentrancies=True):
-        for d in descendants:
-            if s in descendants[d]:
-                descendants[d].update(descendants[t])
+    # a spanning tree in breadth first order; walking it backwards finishes each subtree before its parent
+    for s, r, t in reversed(list(breadth_first_edges(amr, ignore_reentrancies=True))):
+        if s in descendants:
+            descendants[s].update(descendants[t])
+    # the first alignment of each token and node, as amr.get_alignment() would find it
+    token_alignments = {}
+    node_alignments = {}
+    for align in alignments.get(amr.id, []):
+        for tok in align.tokens:
+            token_alignments.setdefault(tok, align)
+        for n in align.nodes:
+            node_alignments.setdefault(n, align)
     positions = {}
-    alignments = {}
     for n in amr.nodes:
-        align = amr.get_alignment(node_id=n)
-        alignments[n] = align
-        if align:
-            positions[n] = align.tokens[0]
+        if n not in node_alignments:
+            node_alignments[n] = AMR_Alignment()
+        elif node_alignments[n]:
+            positions[n] = node_alignments[n].tokens[0]
 
     nonprojective = {}
     used = set()
     for n in breadth_first_nodes(amr):
         if n in used:
             continue
-        test, span = is_projective_node_(amr, n, descendants[n], positions)
-        used.update(alignments[n].nodes)
+        test, span = is_projective_node_(amr, n, descendants[n], positions, token_alignments)
+        used.update(node_alignments[n].nodes)
         if not test:
             nonprojective[n] = span
     if not nonprojective:
@@ -119,32 +123,48 @@ def is_projective(amr):
     culprits = []
     for n in nonprojective:
         for tok in nonprojective[n]:
-            align = amr.get_alignment(token_id=tok)
+            align = token_alignments.get(tok)
             if not align or align in used:
                 continue
-            test, _ = is_projective_node_(amr, n, descendants[n], positions, ignore=align.tokens)
+            test, _ = is_projective_node_(amr, n, descendants[n], positions, token_alignments, ignore=align.tokens)
             used.add(align)
             if test:
                 culprits.append(align)
     return False, culprits
 
 
+def out_edges_(amr):
+    # outgoing edges of each node, each with its index in amr.edges
+    out_edges = {}
+    for i, e in enumerate(amr.edges):
+        out_edges.setdefault(e[0], []).append((i, e))
+    return out_edges
+
+
+def next_layer_(out_edges, new_nodes):
+    # edges leaving the nodes reached in the last layer, by role and then by order in amr.edges
+    children = [(i, e) for n in new_nodes for i, e in out_edges.get(n, [])]
+    children.sort(key=lambda x: (x[1][1].lower(), x[0]))
+    return [e for i, e in children]
+
+
 def breadth_first_nodes(amr):
     if amr.root is None:
         return
-    nodes = [amr.root]
-    children = [(s,r,t) for s,r,t in amr.edges if s in nodes]
-    children = sorted(children, key=lambda x: x[1].lower())
-    edges = [e for e in amr.edges]
+    # every edge out of an older node was already followed, so each layer
+    # only needs the edges out of the nodes reached in the layer before
+    out_edges = out_edges_(amr)
+    nodes = {amr.root}
+    children = next_layer_(out_edges, [amr.root])
     yield amr.root
     while True:
+        new_nodes = []
         for s,r,t in children:
             if t not in nodes:
-                nodes.append(t)
+                nodes.add(t)
+                new_nodes.append(t)
                 yield t
-            edges.remove((s,r,t))
-        children = [(s, r, t) for s, r, t in edges if s in nodes and t not in nodes]
-        children = list(sorted(children, key=lambda x: x[1].lower()))
+        children = [e for e in next_layer_(out_edges, new_nodes) if e[2] not in nodes]
         if not children:
             break
 
@@ -152,30 +172,29 @@ def breadth_first_nodes(amr):
 def breadth_first_edges(amr, ignore_reentrancies=False):
     if amr.root is None:
         return
-    nodes = [amr.root]
-    children = [(s,r,t) for s,r,t in amr.edges if s in nodes]
-    children = sorted(children, key=lambda x: x[1].lower())
-    edges = [e for e in amr.edges]
+    out_edges = out_edges_(amr)
+    nodes = {amr.root}
+    children = next_layer_(out_edges, [amr.root])
     while True:
+        new_nodes = []
         for s,r,t in children:
-            edges.remove((s, r, t))
             if ignore_reentrancies and t in nodes:
                 continue
             if t not in nodes:
-                nodes.append(t)
+                nodes.add(t)
+                new_nodes.append(t)
             yield (s,r,t)
-        children = [(s, r, t) for s, r, t in edges if s in nodes]
-        children = list(sorted(children, key=lambda x: x[1].lower()))
+        children = next_layer_(out_edges, new_nodes)
         if not children:
             break
 
 
 def depth_first_nodes(amr):
+    out_edges = out_edges_(amr)
     visited, stack = {amr.root}, []
-    children = [(s, r, t) for s, r, t in amr.edges if s == amr.root and t not in visited]
+    children = [(s, r, t) for i, (s, r, t) in out_edges.get(amr.root, []) if t not in visited]
     children = list(sorted(children, key=lambda x: x[1].lower(), reverse=True))
     stack.extend(children)
-    edges = [e for e in amr.edges]
     yield amr.root
 
     while stack:
@@ -183,38 +202,45 @@ def depth_first_nodes(amr):
         if t in visited:
             continue
         yield t
-        edges.remove((s, r, t))
         visited.add(t)
-        children = [(s2, r2, t2) for s2, r2, t2 in edges if s2 == t]
+        # each node is expanded once, so none of its edges have been followed yet
+        children = [e for i, e in out_edges.get(t, [])]
         children = list(sorted(children, key=lambda x: x[1].lower(), reverse=True))
         stack.extend(children)
 
 
 def depth_first_edges(amr, ignore_reentrancies=False):
+    # edges not yet followed, by source node
+    out_edges = {n: [e for i, e in edges] for n, edges in out_edges_(amr).items()}
     visited, stack = {amr.root}, []
-    children = [(s, r, t) for s, r, t in amr.edges if s == amr.root and t not in visited]
+    children = [(s, r, t) for s, r, t in out_edges.get(amr.root, []) if t not in visited]
     children = list(sorted(children, key=lambda x: x[1].lower(), reverse=True))
     stack.extend(children)
-    edges = [e for e in amr.edges]
 
     while stack:
         s,r,t = stack.pop()
         if ignore_reentrancies and t in visited:
             continue
         yield (s,r,t)
-        edges.remove((s,r,t))
+        out_edges[s].remove((s,r,t))
         visited.add(t)
-        children = [(s2,r2,t2) for s2,r2,t2 in edges if s2==t]
-        children = list(sorted(children, key=lambda x: x[1].lower(), reverse=True))
+        children = list(sorted(out_edges.get(t, []), key=lambda x: x[1].lower(), reverse=True))
         stack.extend(children)
 
 
 def get_shortest_path(amr, n1, n2, ignore_reentrancies=False):
     path = [n1]
+    # where each node sits on the current path, so the path is cut back to s with one slice
+    positions = {n1: [0]}
     for s,r,t in depth_first_edges(amr, ignore_reentrancies):
-        if s in path:
-            while path[-1]!=s:
-                path.pop()
+        if s in positions:
+            cut = positions[s][-1]+1
+            for n in path[cut:]:
+                positions[n].pop()
+                if not positions[n]:
+                    del positions[n]
+            del path[cut:]
+            positions.setdefault(t, []).append(len(path))
             path.append(t)
             if t==n2:
                 return path
@@ -240,18 +266,10 @@ def get_shortest_path(amr, n1, n2, ignore_reentrancies=False):
 def get_node_alignment(amr1:AMR, amr2:AMR):
     prefix1 = "a"
     prefix2 = "b"
-    node_map1 = {}
-    node_map2 = {}
-    idx = 0
-    for n in amr1.nodes.copy():
-        amr1._rename_node(n, prefix1+str(idx))
-        node_map1[prefix1+str(idx)] = n
-        idx+=1
-    idx = 0
-    for n in amr2.nodes.copy():
-        amr2._rename_node(n, prefix2+str(idx))
-        node_map2[prefix2 + str(idx)] = n
-        idx += 1
+    node_map1 = {prefix1+str(idx): n for idx, n in enumerate(amr1.nodes)}
+    node_map2 = {prefix2+str(idx): n for idx, n in enumerate(amr2.nodes)}
+    amr1._rename_nodes({n: a for a, n in node_map1.items()})
+    amr2._rename_nodes({n: b for b, n in node_map2.items()})
     instance1 = []
     attributes1 = []
     relation1 = []
@@ -280,10 +298,8 @@ def get_node_alignment(amr1:AMR, amr2:AMR):
                                                     doattribute=doattribute, dorelation=dorelation)
     test_triple_num = len(instance1) + len(attributes1) + len(relation1)
     gold_triple_num = len(instance2) + len(attributes2) + len(relation2)
-    for n in amr1.nodes.copy():
-        amr1._rename_node(n, node_map1[n])
-    for n in amr2.nodes.copy():
-        amr2._rename_node(n, node_map2[n])
+    amr1._rename_nodes(node_map1)
+    amr2._rename_nodes(node_map2)
 
     align_map = {}
     for i,j in enumerate(best_mapping):
@@ -294,11 +310,17 @@ def get_node_alignment(amr1:AMR, amr2:AMR):
         align_map[node_map1[a]] = node_map2[b]
     if amr1.root not in align_map:
         align_map[amr1.root] = amr2.root
+    # targets of amr2's edges by source and role, in edge order
+    out_edges2 = {}
+    for s2,r2,t2 in amr2.edges:
+        out_edges2.setdefault((s2,r2), []).append(t2)
     for s,r,t in breadth_first_edges(amr1, ignore_reentrancies=True):
         if t not in align_map:
-            for s2,r2,t2 in amr2.edges:
-                if align_map[s]==s2 and r==r2 and amr1.nodes[t]==amr2.nodes[t2]:
+            # the last matching edge wins
+            for t2 in reversed(out_edges2.get((align_map[s],r), [])):
+                if amr1.nodes[t]==amr2.nodes[t2]:
                     align_map[t] = t2
+                    break
             if t not in align_map:
                 align_map[t] = align_map[s]
 
@@ -1,4 +1,5 @@
 import html
+import io
 import sys
 
 
@@ -52,12 +53,17 @@ class Latex_AMR:
                   + ' '.join(amr.tokens) + '\n' + str(amr), file=sys.stderr)
 
         max_depth = depth
+        # position of each node within its row, and the length of each row
+        row_pos = {}
+        row_len = {}
+        for n in nodes:
+            depth = node_depth[n]
+            row_pos[n] = row_len.get(depth, 0)
+            row_len[depth] = row_pos[n] + 1
         elems = ['\t% Nodes']
         for n in nodes:
             depth = node_depth[n]
-            row = [n for n in nodes if node_depth[n]==depth]
-            pos = row.index(n)
-            x = Latex_AMR._get_x(pos, len(row))
+            x = Latex_AMR._get_x(row_pos[n], row_len[depth])
             y = Latex_AMR._get_y(depth, max_depth)
             if callable(assign_color):
                 color = assign_color(amr, n)
@@ -77,7 +83,7 @@ class Latex_AMR:
             elif node_depth[s] < node_depth[t]:
                 dir1 = 'south'
                 dir2 = 'north'
-            elif node_depth[s] == node_depth[t] and nodes.index(s)<nodes.index(t):
+            elif node_depth[s] == node_depth[t] and row_pos[s]<row_pos[t]:
                 dir1 = 'east'
                 dir2 = 'west'
             else:
@@ -103,10 +109,10 @@ class Latex_AMR:
 
     @staticmethod
     def style(amrs, assign_color='blue'):
-        output = Latex_AMR.prefix()
+        output = [Latex_AMR.prefix()]
         for amr in amrs:
-            output += Latex_AMR.latex(amr, assign_color)
-        return output
+            output.append(Latex_AMR.latex(amr, assign_color))
+        return ''.join(output)
 
 
 class HTML_AMR:
@@ -126,9 +132,10 @@ class HTML_AMR:
 
     @staticmethod
     def span(text, type, id, desc=''):
-        desc = html.escape(desc)
         text = html.escape(text)
-        return f'<span class="{type}" tok-id="{id}"' + (f' title="{desc}"' if desc else '') +f'>{text}</span>'
+        if desc:
+            return f'<span class="{type}" tok-id="{id}" title="{html.escape(desc)}">{text}</span>'
+        return f'<span class="{type}" tok-id="{id}">{text}</span>'
 
     @staticmethod
     def style_sheet():
@@ -176,22 +183,32 @@ class HTML_AMR:
     def html(amr, assign_node_color=None, assign_node_desc=None, assign_edge_color=None, assign_edge_desc=None,
              assign_token_color=None, assign_token_desc=None, other_args=None):
         from amr_utils.propbank_frames import propbank_frames_dictionary
+        # frame descriptions for this AMR, one role per line
+        descriptions = {}
         amr_string = f'[[{amr.root}]]'
         new_ids = {}
+        taken_ids = set()
         for n in amr.nodes:
             new_id = amr.nodes[n][0] if amr.nodes[n] else 'x'
             if new_id.isalpha() and new_id.islower():
-                if new_id in new_ids.values():
+                if new_id in taken_ids:
                     j = 2
-                    while f'{new_id}{j}' in new_ids.values():
+                    while f'{new_id}{j}' in taken_ids:
                         j += 1
                     new_id = f'{new_id}{j}'
             else:
                 j = 0
-                while f'x{j}' in new_ids.values():
+                while f'x{j}' in taken_ids:
                     j += 1
                 new_id = f'x{j}'
             new_ids[n] = new_id
+            taken_ids.add(new_id)
+        # outgoing edges of each node, in the order they are printed
+        node_edges = {}
+        for e in amr.edges:
+            node_edges.setdefault(e[0], []).append(e)
+        for edges in node_edges.values():
+            edges.sort(key=lambda x: x[1])
         depth = 1
         nodes = {amr.root}
         completed = set()
@@ -200,29 +217,32 @@ class HTML_AMR:
             for n in nodes.copy():
                 id = new_ids[n] if n in new_ids else 'x91'
                 concept = amr.nodes[n] if n in new_ids and amr.nodes[n] else 'None'
-                edges = sorted([e for e in amr.edges if e[0] == n], key=lambda x: x[1])
+                edges = node_edges.get(n, [])
                 targets = set(t for s, r, t in edges)
-                edge_spans = []
-                for s, r, t in edges:
-                    if assign_edge_color:
-                        color = assign_edge_color(amr, (s,r,t), other_args)
-                    else:
-                        color = False
-                    type = 'amr-edge' + (f' {color}' if color else '')
-                    desc = assign_edge_desc(amr, (s,r,t), other_args) if assign_edge_desc else ''
-                    edge_spans.append(f'{HTML_AMR.span(r, type, f"{s}-{t}", desc)} [[{t}]]')
-                children = f'\n{tab}'.join(edge_spans)
-                if children:
-                    children = f'\n{tab}' + children
                 if assign_node_color:
                     color = assign_node_color(amr, n, other_args)
                 else:
                     color = False
 
                 if n not in completed:
+                    # edges are only printed under the first occurrence of a node
+                    edge_spans = []
+                    for s, r, t in edges:
+                        if assign_edge_color:
+                            edge_color = assign_edge_color(amr, (s,r,t), other_args)
+                        else:
+                            edge_color = False
+                        type = 'amr-edge' + (f' {edge_color}' if edge_color else '')
+                        desc = assign_edge_desc(amr, (s,r,t), other_args) if assign_edge_desc else ''
+                        edge_spans.append(f'{HTML_AMR.span(r, type, f"{s}-{t}", desc)} [[{t}]]')
+                    children = f'\n{tab}'.join(edge_spans)
+                    if children:
+                        children = f'\n{tab}' + children
                     if (concept[0].isalpha() and concept not in ['imperative', 'expressive',
                                                                  'interrogative']) or targets or depth==1:
-                        desc = HTML_AMR._get_description(concept, propbank_frames_dictionary)
+                        if concept not in descriptions:
+                            descriptions[concept] = HTML_AMR._get_description(concept, propbank_frames_dictionary)
+                        desc = descriptions[concept]
                         type = 'amr-frame' if desc else "amr-node"
                         if assign_node_desc:
                             desc = assign_node_desc(amr, n, other_args)
@@ -236,10 +256,12 @@ class HTML_AMR:
                         span = HTML_AMR.span(f'{concept}', type, id, desc)
                         amr_string = amr_string.replace(f'[[{n}]]', f'{span}')
                     completed.add(n)
-                type = 'amr-node' + (f' {color}' if color else '')
-                desc = assign_node_desc(amr, n, other_args) if assign_node_desc else ''
-                span = HTML_AMR.span(f'{id}', type, id, desc)
-                amr_string = amr_string.replace(f'[[{n}]]', f'{span}')
+                # any remaining occurrences are reentrancies, printed as the bare id
+                if f'[[{n}]]' in amr_string:
+                    type = 'amr-node' + (f' {color}' if color else '')
+                    desc = assign_node_desc(amr, n, other_args) if assign_node_desc else ''
+                    span = HTML_AMR.span(f'{id}', type, id, desc)
+                    amr_string = amr_string.replace(f'[[{n}]]', f'{span}')
                 nodes.remove(n)
                 nodes.update(targets)
             depth += 1
@@ -259,35 +281,41 @@ class HTML_AMR:
         if len(amr.nodes) == 0:
             span = HTML_AMR.span('a/amr-empty', "amr-node", 'a')
             amr_string = f'({span})'
-        toks = [t for t in amr.tokens]
+        toks = amr.tokens
         if assign_token_color or assign_token_desc:
-            for i,t in enumerate(toks):
+            toks = []
+            for i,t in enumerate(amr.tokens):
                 color = assign_token_color(amr, i, other_args) if assign_token_color else ''
                 desc = assign_token_desc(amr, i, other_args) if assign_token_desc else ''
-                if color or desc:
-                    toks[i] = HTML_AMR.span(t, color, f'tok{i}', desc)
+                toks.append(HTML_AMR.span(t, color, f'tok{i}', desc) if color or desc else t)
         output = f'<div class="amr-container">\n<pre>\n{" ".join(toks)}\n\n{amr_string}</pre>\n</div>\n\n'
         return output
 
     @staticmethod
     def style(amrs, assign_node_color=None, assign_node_desc=None, assign_edge_color=None, assign_edge_desc=None,
-             assign_token_color=None, assign_token_desc=None, other_args=None):
-        output = '<!DOCTYPE html>\n'
-        output += '<html>\n'
-        output += '<style>\n'
-        output += HTML_AMR.style_sheet()
-        output += '</style>\n\n'
-        output += '<body>\n'
-        for amr in amrs:
-            output += HTML_AMR.html(amr,
-                                    assign_node_color, assign_node_desc,
-                                    assign_edge_color, assign_edge_desc,
-                                    assign_token_color, assign_token_desc,
-                                    other_args)
-            output += '<hr>\n'
-        output += '</body>\n'
-        output += '</html>\n'
-        return output
+             assign_token_color=None, assign_token_desc=None, other_args=None, out=None):
+        fragments = (HTML_AMR.html(amr,
+                                   assign_node_color, assign_node_desc,
+                                   assign_edge_color, assign_edge_desc,
+                                   assign_token_color, assign_token_desc,
+                                   other_args) for amr in amrs)
+        return HTML_AMR.write_page(fragments, out)
+
+    @staticmethod
+    def write_page(fragments, out=None):
+        # with an open file as out, each fragment is written as soon as it is rendered;
+        # otherwise the page is returned as a string
+        if out is None:
+            out = io.StringIO()
+            HTML_AMR.write_page(fragments, out)
+            return out.getvalue()
+        out.write('<!DOCTYPE html>\n<html>\n<style>\n')
+        out.write(HTML_AMR.style_sheet())
+        out.write('</style>\n\n<body>\n')
+        for fragment in fragments:
+            out.write(fragment)
+            out.write('<hr>\n')
+        out.write('</body>\n</html>\n')
 
 def main():
     import argparse